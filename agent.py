@@ -8,10 +8,10 @@ from agents import (
     ItemHelpers,
     function_tool, set_trace_processors
 )
-from search import SearchService, CodebaseContext
+from search import SearchService, CodebaseContext, load_embeddings
 from dataclasses import dataclass
 import dsl
-import asyncio, json
+import asyncio, orjson
 
 
 set_trace_processors([])  # disable OpenAI tracing
@@ -85,8 +85,8 @@ def read_prompt_file(file_name: str):
 
 
 def load_db(file_name) -> dict:
-    with open(file_name, "r", encoding="utf-8") as file:
-        return json.load(file)
+    with open(file_name, "rb") as file:
+        return orjson.loads(file.read())
 
 
 async def main():
@@ -96,14 +96,23 @@ async def main():
         base_url='http://localhost:8080/v1/'
     )
 
+    # parsed in worker threads, so the loop isn't blocked while loading
+    ast_index, (embeddings, emb_matrix) = await asyncio.gather(
+        asyncio.to_thread(load_db, "ast.json"),
+        asyncio.to_thread(load_embeddings, "embeddings"),
+    )
     ctx = CodebaseContext(
-        ast_index=load_db("ast.json"),
-        embeddings=load_db("embeddings.json")["embeddings"],
+        ast_index=ast_index,
+        embeddings=embeddings,
+        emb_matrix=emb_matrix,
         embedding_model_name="text-embedding-qwen3-embedding-0.6b",
         openai_client=client,
+        embeddings_name="embeddings",
+        query_cache_path="query_embeddings.cache",
     )
 
-    context = Context(search_service=SearchService(ctx))
+    search_service = SearchService(ctx)
+    context = Context(search_service=search_service)
     settings = ModelSettings(
         extra_args={
             "seed": 42
@@ -121,30 +130,34 @@ async def main():
         tools=[semantic_search, get_symbol, search_by_name, get_class_methods]
     )
 
-    result = Runner.run_streamed(
-        starting_agent=agent,
-        input='{"test": "Given An empty box. When I place 2 x "apple" in it. Then The box contains 2 items."}',
-        context=context
-    )
-
-    async for event in result.stream_events():
-        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
-            print(event.data.delta, end="", flush=True)
-
-        # We'll ignore the raw responses event deltas
-        if event.type == "raw_response_event":
-            continue
-        # When the agent updates, print that
-        elif event.type == "agent_updated_stream_event":
-            print(f"Agent updated: {event.new_agent.name}")
-            continue
-        # When items are generated, print them
-        elif event.type == "run_item_stream_event":
-            if event.item.type == "tool_call_item":
-                print(f"-- Tool was called {event.item.raw_item.name}({event.item.raw_item.arguments})")
-            if event.item.type == "tool_call_output_item":
-                print(f"-- Tool output: {event.item.output}")
-
-    print("=== Run complete ===")
+    try:
+        result = Runner.run_streamed(
+            starting_agent=agent,
+            input='{"test": "Given An empty box. When I place 2 x "apple" in it. Then The box contains 2 items."}',
+            context=context
+        )
+
+        async for event in result.stream_events():
+            if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                print(event.data.delta, end="", flush=True)
+
+            # We'll ignore the raw responses event deltas
+            if event.type == "raw_response_event":
+                continue
+            # When the agent updates, print that
+            elif event.type == "agent_updated_stream_event":
+                print(f"Agent updated: {event.new_agent.name}")
+                continue
+            # When items are generated, print them
+            elif event.type == "run_item_stream_event":
+                if event.item.type == "tool_call_item":
+                    print(f"-- Tool was called {event.item.raw_item.name}({event.item.raw_item.arguments})")
+                if event.item.type == "tool_call_output_item":
+                    print(f"-- Tool output: {event.item.output}")
+
+        print("=== Run complete ===")
+    finally:
+        # flushes the query embedding cache to disk
+        search_service.close()
 
 asyncio.run(main())
\ No newline at end of file
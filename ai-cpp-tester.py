@@ -1,16 +1,33 @@
 # #!/usr/bin/env python3
+import os
 import json
-from openai import OpenAI
-from clang.cindex import Index, Type, TypeKind, CursorKind, AccessSpecifier, CompilationDatabase, Cursor, TranslationUnit
+import orjson
+import asyncio
+import functools
+import argparse
+import numpy as np
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, InternalServerError, RateLimitError
+from clang.cindex import Index, Type, TypeKind, CursorKind, CompilationDatabase, Cursor, TranslationUnit
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import sys
 import hashlib
 
 
 embedding_model = "text-embedding-qwen3-embedding-0.6b"
-
-client = OpenAI(
+# symbols per embeddings request and a rough (characters) budget for a request
+BATCH_SIZE = 64
+BATCH_MAX_CHARS = 32 * 1024
+# embeddings requests in flight at the same time
+JOBS = 8
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 0.5
+# transient failures, the same request is sent again after a delay
+RETRY_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+# the request was rejected as too large, its halves are sent instead
+SPLIT_STATUS_CODES = (400, 413, 422)
+
+client = AsyncOpenAI(
     organization='no-organization',
     api_key='no-key',
     base_url='http://localhost:8080/v1/'
@@ -49,90 +66,164 @@ def progress_bar(iterable, prefix = '', suffix = '', decimals = 1, length = 80,
 
 def make_symbol_id(kind: str, fqn: str) -> str:
     data = f'{kind}:{fqn}'
-    return hashlib.sha512(data.encode("utf-8")).hexdigest()
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
 
 
-def embed_text(text: str) -> list[float]:
-    response = client.embeddings.create(
-        model=embedding_model,
-        input=text
+def make_symbol_key(symbol: dict) -> tuple:
+    # overloads share kind and fqn, parameter types and constness tell them apart
+    return (
+        symbol["kind"],
+        symbol["fqn"],
+        tuple(param["type"] for param in symbol.get("params", [])),
+        symbol.get("is_const", False)
     )
-    return response.data[0].embedding
 
 
-def generate_embeddings(symbols: list[dict]) -> dict:
+async def embed_texts(texts: list[str]) -> list[list[float]]:
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            response = await client.embeddings.create(
+                model=embedding_model,
+                input=texts
+            )
+            rows = sorted(response.data, key=lambda data: data.index)
+            # every text must get exactly one row, or symbols would silently lose their embedding
+            if [data.index for data in rows] != list(range(len(texts))):
+                raise RuntimeError(f"embeddings response rows {[data.index for data in rows]} don't match {len(texts)} texts")
+            return [data.embedding for data in rows]
+        except RETRY_ERRORS:
+            if attempt + 1 == RETRY_ATTEMPTS:
+                raise
+            await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+async def embed_batch(texts: list[str], semaphore: asyncio.Semaphore) -> list[list[float]]:
+    # the server rejects a request that exceeds the model context,
+    # so split the batch in halves until every part fits
+    try:
+        async with semaphore:
+            return await embed_texts(texts)
+    except APIStatusError as e:
+        if e.status_code not in SPLIT_STATUS_CODES or len(texts) == 1:
+            raise
+        middle = len(texts) // 2
+        head, tail = await asyncio.gather(
+            embed_batch(texts[:middle], semaphore),
+            embed_batch(texts[middle:], semaphore)
+        )
+        return head + tail
+
+
+def make_batches(symbols: list[dict], batch_size: int, batch_max_chars: int):
+    batch = []
+    batch_chars = 0
+    for symbol in symbols:
+        chars = len(symbol["text"])
+        if batch and (len(batch) >= batch_size or batch_chars + chars > batch_max_chars):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(symbol)
+        batch_chars += chars
+    if batch:
+        yield batch
+
+
+async def generate_embeddings(symbols: list[dict], batch_size: int = BATCH_SIZE, batch_max_chars: int = BATCH_MAX_CHARS, jobs: int = JOBS) -> tuple[dict, np.ndarray]:
     result = {
         "model": "text-embedding-3-small",
         "dimension": None,
         "embeddings": []
     }
 
-    for symbol in progress_bar(symbols, prefix="calc embeddings"):
-        emb = embed_text(symbol["text"])
-
-        if result["dimension"] is None:
-            result["dimension"] = len(emb)
-
-        result["embeddings"].append({
-            "id": make_symbol_id(symbol["kind"], symbol["fqn"]),
-            "kind": symbol["kind"],
-            "fqn": symbol["fqn"],
-            "file": symbol["file"],
-            "embedding": emb
-        })
-
-    return result
+    semaphore = asyncio.Semaphore(jobs)
+    batches = list(make_batches(symbols, batch_size, batch_max_chars))
+
+    async def embed(number: int, batch: list[dict]):
+        return number, await embed_batch([symbol["text"] for symbol in batch], semaphore)
+
+    # requests complete out of order, so results are placed back by batch number
+    embeddings = [None] * len(batches)
+    tasks = [embed(number, batch) for number, batch in enumerate(batches)]
+    for task in progress_bar(list(asyncio.as_completed(tasks)), prefix="calc embeddings"):
+        number, batch_embeddings = await task
+        embeddings[number] = batch_embeddings
+
+    vectors = []
+    for batch, batch_embeddings in zip(batches, embeddings):
+        for symbol, emb in zip(batch, batch_embeddings):
+            if result["dimension"] is None:
+                result["dimension"] = len(emb)
+
+            result["embeddings"].append({
+                "id": make_symbol_id(symbol["kind"], symbol["fqn"]),
+                "kind": symbol["kind"],
+                "fqn": symbol["fqn"],
+                "file": symbol["file"]
+            })
+            vectors.append(emb)
+
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), result["dimension"] or 0)
+    return result, matrix
+
+
+# kinds are singletons, so membership and `is` checks compare identities
+POINTER_KINDS = frozenset({
+    TypeKind.POINTER,
+    TypeKind.LVALUEREFERENCE,
+    TypeKind.RVALUEREFERENCE
+})
+RECORD_KINDS = frozenset({CursorKind.CLASS_DECL, CursorKind.STRUCT_DECL})
+METHOD_KINDS = frozenset({
+    CursorKind.CXX_METHOD,
+    CursorKind.CONSTRUCTOR,
+    CursorKind.DESTRUCTOR
+})
 
 
 def get_type_fqn(type: Type):
-    names = []
-    
-    is_pointer = type.kind == TypeKind.POINTER
-    is_reference = type.kind in [
-        TypeKind.LVALUEREFERENCE, 
-        TypeKind.RVALUEREFERENCE
-    ]
-
-    if is_pointer or is_reference:
+    if type.kind in POINTER_KINDS:
         type = type.get_pointee()
-            
-    c = type.get_declaration()
-    while c and c.kind != CursorKind.TRANSLATION_UNIT:
-        if c.spelling:
-            names.append(c.spelling)
-        c = c.semantic_parent
 
-    result = "::".join(reversed(names))
-    return result
+    return get_fqn(type.get_declaration())
+
+
+# fqn of every cursor seen in the current translation unit, the class part
+# of a method or parameter type fqn is computed once instead of per use;
+# cursors are valid only within their translation unit, so it is cleared per TU
+fqn_cache: dict[Cursor, str] = {}
 
 
 def get_fqn(cursor: Cursor):
-    names = []
-    c = cursor
-    while c and c.kind != CursorKind.TRANSLATION_UNIT:
-        if c.spelling:
-            names.append(c.spelling)
-        c = c.semantic_parent
-    return "::".join(reversed(names))
+    if cursor is None or cursor.kind is CursorKind.TRANSLATION_UNIT:
+        return ""
+
+    fqn = fqn_cache.get(cursor)
+    if fqn is None:
+        fqn = get_fqn(cursor.semantic_parent)
+        if cursor.spelling:
+            fqn = f"{fqn}::{cursor.spelling}" if fqn else cursor.spelling
+        fqn_cache[cursor] = fqn
+    return fqn
 
 
 def get_namespace_path(cursor: Cursor):
     ns = []
     c = cursor.semantic_parent
-    while c and c.kind != CursorKind.TRANSLATION_UNIT:
-        if c.kind == CursorKind.NAMESPACE:
+    while c and c.kind is not CursorKind.TRANSLATION_UNIT:
+        if c.kind is CursorKind.NAMESPACE:
             ns.append(c.spelling)
         c = c.semantic_parent
     return list(reversed(ns))
 
 
+# indexed by AccessSpecifier.value
+ACCESS_STR = ("none", "public", "protected", "private", "unknown")
+
+
 def access_to_str(access):
-    return {
-        AccessSpecifier.PUBLIC: "public",
-        AccessSpecifier.PROTECTED: "protected",
-        AccessSpecifier.PRIVATE: "private",
-        AccessSpecifier.INVALID: "none"
-    }.get(access, "unknown")
+    value = access.value
+    return ACCESS_STR[value] if value < len(ACCESS_STR) else "unknown"
 
 
 def extract_function(cursor: Cursor):
@@ -166,7 +257,7 @@ def extract_method(cursor: Cursor):
         "namespace": get_namespace_path(cursor),
         "return_type": (
             get_type_fqn(cursor.result_type)
-            if cursor.kind == CursorKind.CXX_METHOD
+            if cursor.kind is CursorKind.CXX_METHOD
             else None
         ),
         "params": [
@@ -202,41 +293,103 @@ def extract_class(cursor: Cursor):
         cls["comment"] = cursor.raw_comment
 
     for c in cursor.get_children():
-        if c.kind in (
-            CursorKind.CXX_METHOD,
-            CursorKind.CONSTRUCTOR,
-            CursorKind.DESTRUCTOR
-        ):
+        if c.kind in METHOD_KINDS:
             cls["methods"].append(extract_method(c))
 
     return cls
 
 
-def is_file_from_includes(include_dirs: set[Path], path: Path):
-    for dir in include_dirs:
-        if path.is_relative_to(dir):
-            return True
-    return False
+@functools.lru_cache(maxsize=None)
+def resolve_file(file_name: str) -> str:
+    # every cursor of a header asks for the same file, stat it only once
+    return str(Path(file_name).resolve(True))
+
+
+def make_include_prefixes(include_dirs: set[Path]) -> tuple[str, ...]:
+    return tuple(sorted(
+        (os.path.join(str(dir), "") for dir in include_dirs),
+        key=len,
+        reverse=True
+    ))
 
 
-def index_cpp_file(index: Index, db, include_dirs, path, clang_args):
-    tu = index.parse(path, args=clang_args, options=TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+def is_file_from_includes(include_prefixes: tuple[str, ...], file_name: str):
+    return file_name.startswith(include_prefixes)
 
-    #for cursor in tu.cursor.walk_preorder():
-    for cursor in progress_bar([c for c in tu.cursor.walk_preorder()], prefix=f'indexing {Path(path).stem}'):
+
+def walk_included(root: Cursor, include_prefixes: tuple[str, ...]):
+    # preorder walk that doesn't descend into declarations from outside of
+    # the include dirs, so system headers are skipped as whole subtrees
+    stack = list(reversed(list(root.get_children())))
+    while stack:
+        cursor = stack.pop()
         if not cursor.location.file:
             continue
 
-        file_name = Path(cursor.location.file.name).resolve(True)
-        if not is_file_from_includes(include_dirs, file_name):
+        file_name = resolve_file(cursor.location.file.name)
+        if not is_file_from_includes(include_prefixes, file_name):
             continue
 
-        if cursor.kind in (CursorKind.CLASS_DECL, CursorKind.STRUCT_DECL):
+        yield cursor, file_name
+        stack.extend(reversed(list(cursor.get_children())))
+
+
+def new_file_db() -> dict:
+    return {
+        "classes": [],
+        "functions": []
+    }
+
+
+# libclang index of a worker process, shared by all translation units it parses
+worker_index: Index = None
+
+
+def init_worker():
+    global worker_index
+    worker_index = Index.create()
+
+
+def make_symbol(symbol: dict, file_name: str) -> tuple[tuple, dict]:
+    return make_symbol_key(symbol), {
+        "kind": symbol["kind"],
+        "fqn": symbol["fqn"],
+        "text": symbol_to_text(symbol),
+        "file": file_name
+    }
+
+
+def index_cpp_file(include_dirs, path, clang_args) -> tuple[dict, list[tuple[tuple, dict]]]:
+    # runs in a worker process: cursors can't be shared between processes,
+    # so every translation unit is parsed and returned as a plain per-file dict
+    # together with the embedding texts of its symbols, rendered while the
+    # extracted records are at hand
+    db = defaultdict(new_file_db)
+    symbols = []
+    include_prefixes = make_include_prefixes(include_dirs)
+    fqn_cache.clear()
+    tu = worker_index.parse(path, args=clang_args, options=TranslationUnit.PARSE_SKIP_FUNCTION_BODIES)
+
+    for cursor, file_name in walk_included(tu.cursor, include_prefixes):
+        if cursor.kind in RECORD_KINDS:
             if cursor.is_definition():
-                db[str(file_name)]["classes"].append(extract_class(cursor))
+                cls = extract_class(cursor)
+                db[file_name]["classes"].append(cls)
+                symbols.append(make_symbol(cls, file_name))
+                for method in cls["methods"]:
+                    symbols.append(make_symbol(method, file_name))
+
+        if cursor.kind is CursorKind.FUNCTION_DECL:
+            fn = extract_function(cursor)
+            db[file_name]["functions"].append(fn)
+            symbols.append(make_symbol(fn, file_name))
 
-        if cursor.kind == CursorKind.FUNCTION_DECL:
-            db[str(file_name)]["functions"].append(extract_function(cursor))
+    fqn_cache.clear()
+    return db, symbols
+
+
+# comments are put on a single line of the symbol text
+NL_TO_SPACE = str.maketrans({"\n": " ", "\r": " "})
 
 
 def symbol_to_text(symbol: dict) -> str:
@@ -275,55 +428,27 @@ def symbol_to_text(symbol: dict) -> str:
     # 6. Comment
     comment = symbol.get("comment")
     if comment:
-        cleaned = comment.strip().replace("\n", " ")
+        cleaned = comment.translate(NL_TO_SPACE).strip()
         lines.append(f"Comment: {cleaned}")
 
     return "\n".join(lines)
 
 
-def generate_symbol_texts(index: dict) -> list[dict]:
-    db = dict()
-    for file_name, file_data in progress_bar(index.items(), prefix="create symbols"):
-
-        for cls in file_data.get("classes", []):
-            symbol = symbol_to_text(cls)
-            if symbol not in db:
-                db[symbol] = {
-                "kind": cls["kind"],
-                "fqn": cls["fqn"],
-                "text": symbol_to_text(cls),
-                "file": file_name
-            }
-
-            for method in cls.get("methods", []):
-                symbol = symbol_to_text(method)
-                db[symbol] = {
-                    "kind": method["kind"],
-                    "fqn": method["fqn"],
-                    "text": symbol_to_text(method),
-                    "file": file_name
-                }
-
-        for fn in file_data.get("functions", []):
-            symbol = symbol_to_text(fn)
-            db[symbol] = {
-                "kind": fn["kind"],
-                "fqn": fn["fqn"],
-                "text": symbol_to_text(fn),
-                "file": file_name
-            }
-
-    return [val for _, val in db.items()]
-
-
 def save_index(index_data, out_path):
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(
             index_data,
-            f,
-            indent=2,
-            ensure_ascii=False
-        )
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        ))
+
+
+def save_embeddings(embeddings: dict, matrix: np.ndarray, name: str):
+    # rows are stored L2-normalized, so the search can memory-map them as is;
+    # float16 halves the file and is upcast tile by tile when scored
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    np.save(f"{name}.npy", (matrix / norms).astype(np.float16))
+    save_index(embeddings, f"{name}_meta.json")
 
 
 def load_db(file_name) -> dict:
@@ -332,32 +457,56 @@ def load_db(file_name) -> dict:
 
 
 def save_db(file_name, db: dict):
-    with open(file_name, "w", encoding="utf-8") as file:
-        json.dump(db, file, indent=2, ensure_ascii=False)
+    with open(file_name, "wb") as file:
+        file.write(orjson.dumps(db, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
 
 
-ast_db = defaultdict(
-    lambda: {
-        "classes": [],
-        "functions": []
-    }
-)
-compilation_db = CompilationDatabase.fromDirectory(sys.argv[1])
-
-include_dirs = set()
-for command in compilation_db.getAllCompileCommands():
-    for arg in command.arguments:
-        if arg.startswith("-I"):
-            include_dirs.add(Path(arg[2:]).resolve(True))
-
-index = Index.create()
-for command in compilation_db.getAllCompileCommands():
-    arguments = [arg for arg in command.arguments]
-    arguments = arguments[1:-2]
-    arguments.append('-fparse-all-comments')
-    index_cpp_file(index, ast_db, include_dirs, command.filename, arguments)
-
-symbols = generate_symbol_texts(ast_db)
-save_index(symbols, "symbols.json")
-save_index(generate_embeddings(symbols), 'embeddings.json')
-save_index(ast_db, "ast.json")
+def main():
+    parser = argparse.ArgumentParser(
+        prog='ai-cpp-tester',
+        description='this program parse c++ project and generate json data bases with c++ entities and their embeddings',
+    )
+    parser.add_argument('build_dir', help='directory with compile_commands.json')
+    parser.add_argument('--index-jobs', type=int, default=None, help='translation units parsed in parallel (default: number of CPUs)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='symbols per embeddings request')
+    parser.add_argument('--jobs', type=int, default=JOBS, help='embeddings requests in flight at the same time')
+    args = parser.parse_args()
+
+    ast_db = defaultdict(new_file_db)
+    compilation_db = CompilationDatabase.fromDirectory(args.build_dir)
+
+    include_dirs = set()
+    for command in compilation_db.getAllCompileCommands():
+        for arg in command.arguments:
+            if arg.startswith("-I"):
+                include_dirs.add(Path(arg[2:]).resolve(True))
+
+    with ProcessPoolExecutor(max_workers=args.index_jobs, initializer=init_worker) as executor:
+        futures = []
+        for command in compilation_db.getAllCompileCommands():
+            arguments = [arg for arg in command.arguments]
+            arguments = arguments[1:-2]
+            arguments.append('-fparse-all-comments')
+            futures.append(executor.submit(index_cpp_file, include_dirs, command.filename, arguments))
+
+        # merged in submission order to keep the output stable between runs;
+        # headers are seen by many translation units, the first record wins
+        unique_symbols = dict()
+        for future in progress_bar(futures, prefix="indexing"):
+            file_db, file_symbols = future.result()
+            for file_name, file_data in file_db.items():
+                ast_db[file_name]["classes"].extend(file_data["classes"])
+                ast_db[file_name]["functions"].extend(file_data["functions"])
+            for key, symbol in file_symbols:
+                unique_symbols.setdefault(key, symbol)
+
+    symbols = list(unique_symbols.values())
+    save_index(symbols, "symbols.json")
+    embeddings, matrix = asyncio.run(generate_embeddings(symbols, batch_size=args.batch_size, jobs=args.jobs))
+    save_embeddings(embeddings, matrix, "embeddings")
+    save_index(ast_db, "ast.json")
+
+
+# worker processes import this module, the indexing must run only in the parent
+if __name__ == "__main__":
+    main()
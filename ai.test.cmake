@@ -10,7 +10,7 @@ function(ai_test)
     set(DEFAULT_FLAGS "${CMAKE_CXX_FLAGS_${CONFIG_TYPE}}")
 
     set(TARGET_INDEX_FILE ${CMAKE_CURRENT_BINARY_DIR}/${TARGET_NAME}.index.json)
-    set(TARGET_EMBEDDINGS_FILE ${CMAKE_CURRENT_BINARY_DIR}/${TARGET_NAME}.embeddings.json)
+    set(TARGET_EMBEDDINGS_FILE ${CMAKE_CURRENT_BINARY_DIR}/${TARGET_NAME}.embeddings)
     set(TARGET_TEST_SCENARIOS ${CMAKE_CURRENT_BINARY_DIR}/${TARGET_NAME}.scenarios.cpp)
 
     set(TARGET_INDEXES "")
@@ -66,7 +66,8 @@ function(ai_test)
 
     add_custom_command(
         OUTPUT
-            ${TARGET_EMBEDDINGS_FILE}
+            ${TARGET_EMBEDDINGS_FILE}.npy
+            ${TARGET_EMBEDDINGS_FILE}_meta.json
         COMMAND
             ${Python_EXECUTABLE} ${CMAKE_CURRENT_FUNCTION_LIST_DIR}/cpp.embedding.py ${TARGET_INDEX_FILE} ${TARGET_EMBEDDINGS_FILE}
         DEPENDS
@@ -76,7 +77,8 @@ function(ai_test)
     add_custom_target(
         ${TARGET_NAME}.embeddings
         DEPENDS
-            ${TARGET_EMBEDDINGS_FILE}
+            ${TARGET_EMBEDDINGS_FILE}.npy
+            ${TARGET_EMBEDDINGS_FILE}_meta.json
     )
 
     add_custom_command(
@@ -90,7 +92,8 @@ function(ai_test)
                 ${ARGV}
         DEPENDS
             ${CMAKE_CURRENT_FUNCTION_LIST_DIR}/ai.tester.py
-            ${TARGET_EMBEDDINGS_FILE}
+            ${TARGET_EMBEDDINGS_FILE}.npy
+            ${TARGET_EMBEDDINGS_FILE}_meta.json
             ${TARGET_INDEX_FILE}
     )
     add_executable(${TARGET_NAME}.test ${TARGET_TEST_SCENARIOS})
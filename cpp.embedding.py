@@ -1,45 +1,110 @@
 # #!/usr/bin/env python3
 import json
+import orjson
+import asyncio
 import argparse
-import struct
 import hashlib
-from openai import OpenAI
+import numpy as np
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, InternalServerError, RateLimitError
 
 
 def make_str_hash(string: str) -> str:
-    return hashlib.sha512(string.encode("utf-8")).hexdigest()
-
-
-def float_to_str(value: float) -> str:
-    return bytearray(struct.pack(">f", value)).hex()
-
+    return hashlib.blake2b(string.encode("utf-8"), digest_size=16).hexdigest()
+
+
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 0.5
+# transient failures, the same request is sent again after a delay
+RETRY_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+# the request was rejected as too large, its halves are sent instead
+SPLIT_STATUS_CODES = (400, 413, 422)
+
+
+async def embed_texts(texts: list[str], client: AsyncOpenAI, model: str) -> list[list[float]]:
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            response = await client.embeddings.create(
+                model=model,
+                input=texts
+            )
+            rows = sorted(response.data, key=lambda data: data.index)
+            # every text must get exactly one row, or symbols would silently lose their embedding
+            if [data.index for data in rows] != list(range(len(texts))):
+                raise RuntimeError(f"embeddings response rows {[data.index for data in rows]} don't match {len(texts)} texts")
+            return [data.embedding for data in rows]
+        except RETRY_ERRORS:
+            if attempt + 1 == RETRY_ATTEMPTS:
+                raise
+            await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+async def embed_batch(texts: list[str], client: AsyncOpenAI, model: str, semaphore: asyncio.Semaphore) -> list[list[float]]:
+    # the server rejects a request that exceeds the model context,
+    # so split the batch in halves until every part fits
+    try:
+        async with semaphore:
+            return await embed_texts(texts, client, model)
+    except APIStatusError as e:
+        if e.status_code not in SPLIT_STATUS_CODES or len(texts) == 1:
+            raise
+        middle = len(texts) // 2
+        head, tail = await asyncio.gather(
+            embed_batch(texts[:middle], client, model, semaphore),
+            embed_batch(texts[middle:], client, model, semaphore)
+        )
+        return head + tail
 
-def str_to_float(string: str) -> float:
-    array = bytes.fromhex(string)
-    return struct.unpack(">f", array)
 
+def make_batches(symbols: dict, batch_size: int, batch_max_chars: int):
+    batch = []
+    batch_chars = 0
+    for id, symbol in symbols.items():
+        chars = len(symbol["text"])
+        if batch and (len(batch) >= batch_size or batch_chars + chars > batch_max_chars):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append((id, symbol))
+        batch_chars += chars
+    if batch:
+        yield batch
+
+
+async def generate_embeddings(symbols: dict, client: AsyncOpenAI, model: str, batch_size: int, batch_max_chars: int, jobs: int) -> tuple[dict, np.ndarray]:
+    semaphore = asyncio.Semaphore(jobs)
+    batches = list(make_batches(symbols, batch_size, batch_max_chars))
+    embeddings = await asyncio.gather(*[
+        embed_batch([symbol["text"] for _, symbol in batch], client, model, semaphore)
+        for batch in batches
+    ])
+
+    result = {
+        "model": model,
+        "dimension": None,
+        "embeddings": []
+    }
+    vectors = []
+    for batch, batch_embeddings in zip(batches, embeddings):
+        for (id, symbol), emb in zip(batch, batch_embeddings):
+            if result["dimension"] is None:
+                result["dimension"] = len(emb)
+
+            record = {
+                "id": id,
+                "kind": symbol["kind"],
+                "fqn": symbol["fqn"],
+            }
+            if "signature" in symbol:
+                record["signature"] = symbol.get("signature")
+            result["embeddings"].append(record)
+            vectors.append(emb)
 
-def embed_text(text: str, client: OpenAI, model: str) -> list[float]:
-    response = client.embeddings.create(
-        model=model,
-        input=text
-    )
-    return response.data[0].embedding
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), result["dimension"] or 0)
+    return result, matrix
 
 
-def generate_embeddings(symbols: dict, client: OpenAI, model: str) -> dict:
-    result = dict()
-    for id, symbol in symbols.items():
-        emb = embed_text(symbol["text"], client, model)
-        key = ".".join([float_to_str(value) for value in emb])
-        result[key] = {
-            "id": id,
-            "kind": symbol["kind"],
-            "fqn": symbol["fqn"],
-        }
-        if "signature" in symbol:
-            result[key]["signature"] = symbol.get("signature")
-    return result
+# comments are put on a single line of the symbol text
+NL_TO_SPACE = str.maketrans({"\n": " ", "\r": " "})
 
 
 def symbol_to_text(symbol: dict) -> str:
@@ -68,7 +133,7 @@ def symbol_to_text(symbol: dict) -> str:
 
     comment = symbol.get("comment")
     if comment:
-        cleaned = comment.strip().replace("\n", " ")
+        cleaned = comment.translate(NL_TO_SPACE).strip()
         lines.append(f"Comment: {cleaned}")
 
     return "\n".join(lines)
@@ -130,13 +195,20 @@ def generate_symbol_texts(index: dict) -> list[dict]:
 
 
 def save_index(index_data, out_path):
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(
             index_data,
-            f,
-            indent=2,
-            ensure_ascii=False
-        )
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        ))
+
+
+def save_embeddings(embeddings: dict, matrix: np.ndarray, name: str):
+    # rows are stored L2-normalized, so the search can memory-map them as is;
+    # float16 halves the file and is upcast tile by tile when scored
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    np.save(f"{name}.npy", (matrix / norms).astype(np.float16))
+    save_index(embeddings, f"{name}_meta.json")
 
 
 def load_index(file_name) -> dict:
@@ -149,12 +221,15 @@ parser = argparse.ArgumentParser(
     description='this program parse c++ source files and generate json data base with c++ entities',
 )
 parser.add_argument('ast_db', help='input C/C++ ast data base in json format')
-parser.add_argument('embeddings', help='output embeddings json file')
+parser.add_argument('embeddings', help='output embeddings name, writes <name>.npy matrix and <name>_meta.json metadata')
+parser.add_argument('--batch-size', type=int, default=64, help='symbols per embeddings request')
+parser.add_argument('--batch-max-chars', type=int, default=32 * 1024, help='max total text length of one embeddings request')
+parser.add_argument('--jobs', type=int, default=8, help='embeddings requests in flight at the same time')
 args = parser.parse_args()
 
 
 model = "text-embedding-qwen3-embedding-0.6b"
-client = OpenAI(
+client = AsyncOpenAI(
     organization='no-organization',
     api_key='no-key',
     base_url='http://localhost:8080/v1/'
@@ -162,5 +237,5 @@ client = OpenAI(
 
 ast_db = load_index(args.ast_db)
 symbols = generate_symbol_texts(ast_db)
-embeddings = generate_embeddings(symbols, client, model)
-save_index(embeddings, args.embeddings)
+embeddings, matrix = asyncio.run(generate_embeddings(symbols, client, model, args.batch_size, args.batch_max_chars, args.jobs))
+save_embeddings(embeddings, matrix, args.embeddings)
@@ -1,6 +1,9 @@
 # #!/usr/bin/env python3
+import os
 import json
+import orjson
 import argparse
+import functools
 from clang.cindex import (
     Index,
     Type,
@@ -13,38 +16,42 @@ from clang.cindex import (
 from pathlib import Path
 
 
-def get_type_fqn(type: Type):
-    names = []
+# kinds are singletons, so membership and `is` checks compare identities
+POINTER_KINDS = frozenset({
+    TypeKind.POINTER,
+    TypeKind.LVALUEREFERENCE,
+    TypeKind.RVALUEREFERENCE
+})
+RECORD_KINDS = frozenset({CursorKind.CLASS_DECL, CursorKind.STRUCT_DECL})
 
-    is_pointer = type.kind == TypeKind.POINTER
-    is_reference = type.kind in [
-        TypeKind.LVALUEREFERENCE,
-        TypeKind.RVALUEREFERENCE
-    ]
 
-    if is_pointer or is_reference:
+def get_type_fqn(type: Type):
+    if type.kind in POINTER_KINDS:
         type = type.get_pointee()
 
     c = type.get_declaration()
     if c.kind is CursorKind.NO_DECL_FOUND:
         return type.spelling
-    while c and c.kind != CursorKind.TRANSLATION_UNIT:
-        if c.spelling:
-            names.append(c.spelling)
-        c = c.semantic_parent
+    return get_fqn(c)
+
 
-    result = "::".join(reversed(names))
-    return result
+# fqn of every cursor seen in the current translation unit, the class part
+# of a method or parameter type fqn is computed once instead of per use;
+# cursors are valid only within their translation unit, so it is cleared per TU
+fqn_cache: dict[Cursor, str] = {}
 
 
 def get_fqn(cursor: Cursor):
-    names = []
-    c = cursor
-    while c and c.kind != CursorKind.TRANSLATION_UNIT:
-        if c.spelling:
-            names.append(c.spelling)
-        c = c.semantic_parent
-    return "::".join(reversed(names))
+    if cursor is None or cursor.kind is CursorKind.TRANSLATION_UNIT:
+        return ""
+
+    fqn = fqn_cache.get(cursor)
+    if fqn is None:
+        fqn = get_fqn(cursor.semantic_parent)
+        if cursor.spelling:
+            fqn = f"{fqn}::{cursor.spelling}" if fqn else cursor.spelling
+        fqn_cache[cursor] = fqn
+    return fqn
 
 
 def extract_function(cursor: Cursor):
@@ -81,7 +88,7 @@ def extract_method(cursor: Cursor):
         ],
     }
     method["signature"] = get_fqn(cursor) + f'({"".join([arg_fqn["type"] for arg_fqn in method["params"]])})'
-    if cursor.kind == CursorKind.CXX_METHOD:
+    if cursor.kind is CursorKind.CXX_METHOD:
         method["return_type"] = get_type_fqn(cursor.result_type)
     if cursor.raw_comment is not None:
         method["comment"] = cursor.raw_comment
@@ -120,7 +127,7 @@ def extract_class(cursor: Cursor):
         cls["comment"] = cursor.raw_comment
 
     for child in cursor.get_children():
-        if child.access_specifier == AccessSpecifier.PUBLIC:
+        if child.access_specifier is AccessSpecifier.PUBLIC:
             if child.kind is CursorKind.CXX_METHOD:
                 if child.is_static_method():
                     cls["functions"].append(extract_function(child))
@@ -132,46 +139,68 @@ def extract_class(cursor: Cursor):
     return cls
 
 
-def is_file_from_includes(include_dirs: set[Path], path: Path):
-    for dir in include_dirs:
-        if path.is_relative_to(dir):
-            return True
-    return False
+@functools.lru_cache(maxsize=None)
+def resolve_file(file_name: str) -> str:
+    # every cursor of a header asks for the same file, stat it only once
+    return str(Path(file_name).resolve(True))
 
 
-def index_cpp_file(tu, include_dirs):
-    ast_db = {
-        "classes": [],
-        "functions": []
-    }
+def make_include_prefixes(include_dirs: set[Path]) -> tuple[str, ...]:
+    return tuple(sorted(
+        (os.path.join(str(dir), "") for dir in include_dirs),
+        key=len,
+        reverse=True
+    ))
+
 
-    for cursor in tu.cursor.walk_preorder():
+def is_file_from_includes(include_prefixes: tuple[str, ...], file_name: str):
+    return file_name.startswith(include_prefixes)
+
+
+def walk_included(root: Cursor, include_prefixes: tuple[str, ...]):
+    # preorder walk that doesn't descend into declarations from outside of
+    # the include dirs, so system headers are skipped as whole subtrees
+    stack = list(reversed(list(root.get_children())))
+    while stack:
+        cursor = stack.pop()
         if not cursor.location.file:
             continue
 
-        file_name = Path(cursor.location.file.name).resolve(True)
-        if not is_file_from_includes(include_dirs, file_name):
+        file_name = resolve_file(cursor.location.file.name)
+        if not is_file_from_includes(include_prefixes, file_name):
             continue
 
-        if cursor.kind in (CursorKind.CLASS_DECL, CursorKind.STRUCT_DECL):
+        yield cursor, file_name
+        stack.extend(reversed(list(cursor.get_children())))
+
+
+def index_cpp_file(tu, include_dirs):
+    ast_db = {
+        "classes": [],
+        "functions": []
+    }
+    include_prefixes = make_include_prefixes(include_dirs)
+    fqn_cache.clear()
+
+    for cursor, _ in walk_included(tu.cursor, include_prefixes):
+        if cursor.kind in RECORD_KINDS:
             if cursor.is_definition():
                 ast_db["classes"].append(extract_class(cursor))
 
-        if cursor.kind == CursorKind.FUNCTION_DECL:
+        if cursor.kind is CursorKind.FUNCTION_DECL:
             ast_db
             ["functions"].append(extract_function(cursor))
 
+    fqn_cache.clear()
     return ast_db
 
 
 def save_index(index_data, out_path):
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(
             index_data,
-            f,
-            indent=2,
-            ensure_ascii=False
-        )
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+        ))
 
 
 def load_index(file_name) -> dict:
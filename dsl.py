@@ -1,83 +1,68 @@
 from dataclasses import dataclass, field
 from typing import Any, List, Dict, Optional, Union
-import json
+import os
+import re
+import pickle
+import orjson
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 
 class DSLValidationError(Exception):
     pass
 
 
-@dataclass
+@dataclass(slots=True, frozen=True, kw_only=True)
 class Step:
     op: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True, kw_only=True)
 class CreateStep(Step):
+    op: str = "create"
     id: str
     type: str
     args: List[Any] = field(default_factory=list)
 
-    def __init__(self, **kw):
-        super().__init__(op="create")
-        self.id = kw["id"]
-        self.type = kw["type"]
-        self.args = kw.get("args", [])
-
 
-@dataclass
+@dataclass(slots=True, frozen=True, kw_only=True)
 class CallStep(Step):
+    op: str = "call"
     target: str
     method: str
-    args: List[Any]
-    result: Optional[str]
-
-    def __init__(self, **kw):
-        super().__init__(op="call")
-        self.target = kw["target"]
-        self.method = kw["method"]
-        self.args = kw.get("args", [])
-        self.result = kw.get("result")
+    args: List[Any] = field(default_factory=list)
+    result: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True, frozen=True, kw_only=True)
 class GetStep(Step):
+    op: str = "get"
     target: str
     field: str
     result: str
 
-    def __init__(self, **kw):
-        super().__init__(op="get")
-        self.target = kw["target"]
-        self.field = kw["field"]
-        self.result = kw["result"]
 
-
-@dataclass
+@dataclass(slots=True, frozen=True)
 class AssertExpr:
     op: str
     left: Any
     right: Any
 
 
-@dataclass
+@dataclass(slots=True, frozen=True, kw_only=True)
 class AssertStep(Step):
+    op: str = "assert"
     expr: AssertExpr
 
-    def __init__(self, **kw):
-        super().__init__(op="assert")
-        e = kw["expr"]
-        self.expr = AssertExpr(**e)
-
 
-@dataclass
+@dataclass(slots=True, frozen=True, kw_only=True)
 class ExpectFailStep(Step):
+    op: str = "expect_fail"
     step: int
 
-    def __init__(self, **kw):
-        super().__init__(op="expect_fail")
-        self.step = kw["step"]
-
 
 @dataclass
 class TestPlan:
@@ -99,7 +84,13 @@ def parse_step(data: Dict[str, Any]) -> Step:
     if op not in STEP_CLASSES:
         raise DSLValidationError(f"Unknown op '{op}'")
 
-    return STEP_CLASSES[op](**data)
+    kw = {k: v for k, v in data.items() if k != "op"}
+    try:
+        if op == "assert":
+            kw["expr"] = AssertExpr(**kw["expr"])
+        return STEP_CLASSES[op](**kw)
+    except (KeyError, TypeError) as e:
+        raise DSLValidationError(f"Invalid '{op}' step: {e}") from None
 
 
 def parse_test_plan(data: Dict[str, Any]) -> TestPlan:
@@ -123,6 +114,12 @@ class ASTProvider:
     def find_method(self, class_fqn: str, method_fqn: str) -> dict | None:
         raise NotImplementedError
 
+    def get_field_names(self, fqn: str) -> frozenset[str]:
+        cls = self.get_class(fqn)
+        if not cls:
+            return frozenset()
+        return frozenset(f["name"] for f in cls.get("fields", []))
+
 
 class DSLContext:
     def __init__(self, ast):
@@ -130,18 +127,17 @@ class DSLContext:
         self.variables: dict[str, str] = {}  # var -> type
 
 
+# literal arguments, the name of the matched group is the type
+ARG_LITERAL = re.compile(r"(?P<int>-?\d+)|(?P<double>-?(?:\d+\.\d*|\.\d+))|(?P<bool>true|false)")
+
+
 def infer_arg_type(arg: str, ctx: DSLContext) -> str:
     if arg in ctx.variables:
         return ctx.variables[arg]
 
-    if arg.isdigit():
-        return "int"
-
-    if arg.replace(".", "", 1).isdigit():
-        return "double"
-
-    if arg in ("true", "false"):
-        return "bool"
+    literal = ARG_LITERAL.fullmatch(arg)
+    if literal:
+        return literal.lastgroup
 
     if isinstance(arg, str):
         return "std::string"
@@ -188,19 +184,12 @@ def validate_plan(plan: TestPlan, ast_provider: ASTProvider):
 
 
 def validate_step(step: Step, ctx: DSLContext):
-    if isinstance(step, CreateStep):
-        validate_create(step, ctx)
-    elif isinstance(step, CallStep):
-        validate_call(step, ctx)
-    elif isinstance(step, GetStep):
-        validate_get(step, ctx)
-    elif isinstance(step, AssertStep):
-        validate_assert(step, ctx)
-    elif isinstance(step, ExpectFailStep):
-        validate_expect_fail(step, ctx)
-    else:
+    validator = VALIDATORS.get(type(step))
+    if validator is None:
         raise DSLValidationError("Unsupported step type")
 
+    validator(step, ctx)
+
 
 def validate_create(step: CreateStep, ctx: DSLContext):
     ctors = ctx.ast.get_constructors(step.type)
@@ -255,8 +244,7 @@ def validate_get(step: GetStep, ctx: DSLContext):
     if not cls:
         raise DSLValidationError("Invalid target type")
 
-    fields = cls.get("fields", [])
-    if step.field not in {f["name"] for f in fields}:
+    if step.field not in ctx.ast.get_field_names(cls["fqn"]):
         raise DSLValidationError(
             f"Field '{step.field}' not found in '{cls['fqn']}'"
         )
@@ -278,24 +266,41 @@ def validate_expect_fail(step: ExpectFailStep, ctx: DSLContext):
         raise DSLValidationError("step index must be >= 0")
 
 
+VALIDATORS = {
+    CreateStep: validate_create,
+    CallStep: validate_call,
+    GetStep: validate_get,
+    AssertStep: validate_assert,
+    ExpectFailStep: validate_expect_fail,
+}
+
+
 class JsonASTProvider(ASTProvider):
-    def __init__(self, ast_index: dict):
+    def __init__(self, ast_index: dict | None, symbols: dict | None = None, methods_by_class: dict | None = None):
         self.index = ast_index
-        self.symbols = self._build_symbol_index()
-
-    def _build_symbol_index(self):
+        if symbols is None:
+            symbols, methods_by_class = self._build_symbol_index(ast_index.values())
+        self.symbols = symbols
+        self.methods_by_class = methods_by_class  # class fqn -> method fqn -> method
+        self.field_names: dict[str, frozenset[str]] = {}  # class fqn -> field names, filled on first use
+
+    @staticmethod
+    def _build_symbol_index(files) -> tuple[dict, dict]:
         symbols = {}
+        methods_by_class = {}
 
-        for file in self.index.values():
+        for file in files:
             for cls in file.get("classes", []):
                 symbols[cls["fqn"]] = cls
+                methods = methods_by_class[cls["fqn"]] = {}
                 for m in cls.get("methods", []):
                     symbols[m["fqn"]] = m
+                    methods.setdefault(m["fqn"], m)
 
             for fn in file.get("functions", []):
                 symbols[fn["fqn"]] = fn
 
-        return symbols
+        return symbols, methods_by_class
 
     def has_type(self, fqn: str) -> bool:
         sym = self.symbols.get(fqn)
@@ -307,6 +312,12 @@ class JsonASTProvider(ASTProvider):
             return sym
         return None
 
+    def get_field_names(self, fqn: str) -> frozenset[str]:
+        names = self.field_names.get(fqn)
+        if names is None:
+            names = self.field_names[fqn] = super().get_field_names(fqn)
+        return names
+
     def get_constructors(self, fqn: str) -> list[dict]:
         cls = self.get_class(fqn)
         if cls is None:
@@ -320,15 +331,10 @@ class JsonASTProvider(ASTProvider):
         ]
 
     def find_method(self, class_fqn: str, method_fqn: str) -> dict | None:
-        cls = self.get_class(class_fqn)
-        if not cls:
+        if not self.get_class(class_fqn):
             return None
 
-        for m in cls.get("methods", []):
-            if m["fqn"] == method_fqn:
-                return m
-
-        return None
+        return self.methods_by_class[class_fqn].get(method_fqn)
 
 json_plan = {
     "test": "transfer between accounts",
@@ -388,9 +394,48 @@ json_plan = {
 
 
 def load_db(file_name) -> dict:
-    with open(file_name, "r", encoding="utf-8") as file:
-        return json.load(file)
-
-provider = JsonASTProvider(load_db("ast.json"))
+    with open(file_name, "rb") as file:
+        return orjson.loads(file.read())
+
+
+def load_ast_files(file_name):
+    # file records of the ast db, streamed one at a time when ijson is available
+    if ijson is None:
+        yield from load_db(file_name).values()
+        return
+
+    with open(file_name, "rb") as file:
+        for _, record in ijson.kvitems(file, "", use_float=True):
+            yield record
+
+
+def load_ast_provider(file_name) -> JsonASTProvider:
+    # the symbol index is pickled next to the json and reused while its mtime is unchanged
+    cache_file = f"{os.path.splitext(file_name)[0]}.symbols.pkl"
+    mtime = os.stat(file_name).st_mtime_ns
+    try:
+        with open(f"{cache_file}.meta", "rb") as file:
+            cached = int(file.read()) == mtime
+        if cached:
+            with open(cache_file, "rb") as file:
+                cache = pickle.load(file)
+            return JsonASTProvider(None, cache["symbols"], cache["methods_by_class"])
+    except (OSError, ValueError, KeyError, TypeError, EOFError, pickle.UnpicklingError):
+        pass
+
+    provider = JsonASTProvider(None, *JsonASTProvider._build_symbol_index(load_ast_files(file_name)))
+    try:
+        with open(cache_file, "wb") as file:
+            cache = {"symbols": provider.symbols, "methods_by_class": provider.methods_by_class}
+            pickle.dump(cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+        # written last, so an interrupted dump is never taken as valid
+        with open(f"{cache_file}.meta", "wb") as file:
+            file.write(str(mtime).encode())
+    except OSError:
+        pass  # the cache is optional, the index built in memory is enough
+    return provider
+
+
+provider = load_ast_provider("ast.json")
 plan = parse_test_plan(json_plan)
 validate_plan(plan, provider)
\ No newline at end of file
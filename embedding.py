@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 import json
+import orjson
 
 
 def load_db(file_name) -> dict:
@@ -8,8 +9,8 @@ def load_db(file_name) -> dict:
 
 
 def save_db(file_name, db: dict):
-    with open(file_name, "w", encoding="utf-8") as file:
-        json.dump(db, file, indent=2, ensure_ascii=False)
+    with open(file_name, "wb") as file:
+        file.write(orjson.dumps(db, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
 
 
 @dataclass
@@ -1,7 +1,14 @@
 # #!/usr/bin/env python3
+import os
 import json
-import math
+import orjson
 import re
+import asyncio
+import heapq
+import bisect
+import shelve
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI, AsyncClient
 from cli_progress_bar import progress_bar
 
@@ -15,45 +22,418 @@ client = OpenAI(
 )
 
 
-from dataclasses import dataclass
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
 from typing import Any
 
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
 
-def cosine_similarity(a: list[float], b: list[float]) -> float:
-    dot = 0.0
-    na = 0.0
-    nb = 0.0
 
-    for x, y in zip(a, b):
-        dot += x * y
-        na += x * x
-        nb += y * y
-
-    if na == 0.0 or nb == 0.0:
-        return 0.0
-
-    return dot / math.sqrt(na * nb)
+# rows of the scanned matrix upcast to float32 at once
+SCAN_TILE_BYTES = 1 << 20
+# candidates taken from the int8 scan per requested result, reranked in float32
+RERANK_FACTOR = 4
+# threads sharing the brute-force scan, numpy releases the GIL while scoring a tile
+SCAN_THREADS = os.cpu_count() or 1
+# queries arriving within this window (seconds) are embedded by one request
+EMBED_BATCH_WINDOW = 0.005
+EMBED_BATCH_SIZE = 32
+QUERY_CACHE_SIZE = 1024
+# maximal identifier runs of a lowercased name: a query token is a substring
+# of a name exactly when it is a substring of one of its runs
+TOKEN_RUN = re.compile(r"[a-z0-9_]+")
 
 
 @dataclass
 class CodebaseContext:
     ast_index: dict
-    embeddings: list[dict]
+    embeddings: list[dict]  # metadata of emb_matrix rows
+    emb_matrix: np.ndarray  # L2-normalized (N, D) float16 matrix, float32 in older files
     embedding_model_name: str
     openai_client: Any  # OpenAI.AsyncClient
+    query_cache_path: str | None = None  # shelve file keeping query embeddings between runs
+    embeddings_name: str | None = None  # <name>.npy of emb_matrix, its int8 copy or ANN index is cached next to it
+    emb_ids: list[str] = field(init=False, default_factory=list)
+    emb_kinds: list[str] = field(init=False, default_factory=list)
+    emb_fqns: list[str] = field(init=False, default_factory=list)
+    emb_files: list[str] = field(init=False, default_factory=list)
+    ann_index: Any = field(init=False, default=None)  # hnswlib.Index, labels are rows of emb_matrix
+    # int8 copy of emb_matrix for the brute-force scan, row ~= emb_quantized[row] / emb_scales[row]
+    emb_quantized: np.ndarray = field(init=False, default=None)
+    emb_scales: np.ndarray = field(init=False, default=None)
+    # classes, methods and functions of ast_index in traversal order
+    symbol_list: list[dict] = field(init=False, default_factory=list)
+    names_lower: list[str] = field(init=False, default_factory=list)
+    token_postings: dict[str, set[int]] = field(init=False, default_factory=dict)  # run -> symbol_list indices
+    # all runs joined by newlines, searched at once; run_starts[r] is the offset of run_list[r]
+    run_list: list[str] = field(init=False, default_factory=list)
+    run_text: str = field(init=False, default="")
+    run_starts: list[int] = field(init=False, default_factory=list)
+    symbol_by_fqn: dict[str, dict] = field(init=False, default_factory=dict)  # first symbol with the fqn
+    methods_by_class_fqn: dict[str, list[dict]] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        self.index_symbols()
+
+        if not self.embeddings:
+            return
+
+        for item in self.embeddings:
+            self.emb_ids.append(item["id"])
+            self.emb_kinds.append(item["kind"])
+            self.emb_fqns.append(item["fqn"])
+            self.emb_files.append(item["file"])
+
+        if hnswlib is not None and self.embeddings_name is not None:
+            self.ann_index = load_ann_index(self.embeddings_name, self.emb_matrix)
+        elif hnswlib is not None:
+            self.ann_index = build_ann_index(self.emb_matrix)
+        elif self.embeddings_name is not None:
+            self.emb_quantized, self.emb_scales = load_quantized(self.embeddings_name, self.emb_matrix)
+        else:
+            self.emb_quantized, self.emb_scales = quantize_rows(self.emb_matrix)
+
+    def index_symbols(self):
+        for file in self.ast_index.values():
+            for cls in file.get("classes", []):
+                self.add_symbol(cls)
+                self.methods_by_class_fqn.setdefault(cls["fqn"], cls.get("methods", []))
+                for m in cls.get("methods", []):
+                    self.add_symbol(m)
+
+            for fn in file.get("functions", []):
+                self.add_symbol(fn)
+
+        self.run_list = list(self.token_postings)
+        self.run_text = "\n".join(self.run_list)
+        offset = 0
+        for run in self.run_list:
+            self.run_starts.append(offset)
+            offset += len(run) + 1
+
+    def add_symbol(self, symbol: dict):
+        i = len(self.symbol_list)
+        haystack = " ".join([symbol.get("name", ""), symbol.get("fqn", "")]).lower()
+        self.symbol_list.append(symbol)
+        self.symbol_by_fqn.setdefault(symbol["fqn"], symbol)
+        self.names_lower.append(symbol.get("name", "").lower())
+        for run in TOKEN_RUN.findall(haystack):
+            self.token_postings.setdefault(run, set()).add(i)
+
+    def token_matches(self, token: str) -> set[int]:
+        # symbols whose haystack contains token
+        matches = set()
+        last = -1
+        for match in re.finditer(re.escape(token), self.run_text):
+            r = bisect.bisect_right(self.run_starts, match.start()) - 1
+            if r != last:
+                matches |= self.token_postings[self.run_list[r]]
+                last = r
+        return matches
+
+    def name_candidates(self, text: str) -> range | list[int]:
+        # superset of the symbols whose name contains text, in traversal order
+        runs = TOKEN_RUN.findall(text)
+        if not runs:
+            return range(len(self.symbol_list))
+        return sorted(self.token_matches(max(runs, key=len)))
+
+    def name_scores(self, tokens: list[str]) -> dict[str, tuple[dict, float]]:
+        # fqn -> (first symbol with it, best share of tokens found in "name fqn")
+        # Counter.update counts in C; a repeated token is matched only once
+        hits = Counter()
+        for t, repeats in Counter(tokens).items():
+            matches = self.token_matches(t)
+            for _ in range(repeats):
+                hits.update(matches)
+
+        scores = {}
+        for i in sorted(hits):
+            symbol = self.symbol_list[i]
+            score = hits[i] / len(tokens)
+            best = scores.get(symbol["fqn"])
+            if best is None:
+                scores[symbol["fqn"]] = (symbol, score)
+            elif score > best[1]:
+                scores[symbol["fqn"]] = (best[0], score)
+        return scores
+
+    def embedding_hit(self, row: int, score: float) -> dict:
+        return {
+            "id": self.emb_ids[row],
+            "kind": self.emb_kinds[row],
+            "fqn": self.emb_fqns[row],
+            "file": self.emb_files[row],
+            "score": score
+        }
+
+
+def migrate_json_embeddings(name: str):
+    # one-time conversion of the old <name>.json with inline vectors
+    with open(f"{name}.json", "rb") as file:
+        db = orjson.loads(file.read())
+
+    vectors = [item.pop("embedding") for item in db["embeddings"]]
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), db.get("dimension") or 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    np.save(f"{name}.npy", (matrix / norms).astype(np.float16))
+    with open(f"{name}_meta.json", "wb") as file:
+        file.write(orjson.dumps(db, option=orjson.OPT_INDENT_2))
+
+
+def load_embeddings(name: str) -> tuple[list[dict], np.ndarray]:
+    if not os.path.exists(f"{name}.npy") and os.path.exists(f"{name}.json"):
+        migrate_json_embeddings(name)
+
+    with open(f"{name}_meta.json", "rb") as file:
+        meta = orjson.loads(file.read())
+    # memory-mapped: pages of the matrix are read on first access
+    matrix = np.load(f"{name}.npy", mmap_mode="r")
+    return meta["embeddings"], matrix
+
+
+def tile_rows(matrix: np.ndarray) -> int:
+    return max(1, SCAN_TILE_BYTES // (matrix.shape[1] * np.dtype(np.float32).itemsize))
+
+
+def quantize_rows(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    quantized = np.empty(matrix.shape, dtype=np.int8)
+    scales = np.empty(len(matrix), dtype=np.float32)
+    step = tile_rows(matrix)
+    for start in range(0, len(matrix), step):
+        tile = np.asarray(matrix[start:start + step], dtype=np.float32)
+        peaks = np.abs(tile).max(axis=1)
+        peaks[peaks == 0.0] = 1.0
+        tile_scales = 127.0 / peaks
+        quantized[start:start + step] = np.round(tile * tile_scales[:, None])
+        scales[start:start + step] = tile_scales
+    return quantized, scales
+
+
+def is_fresh(name: str, *files: str) -> bool:
+    # files derived from <name>.npy exist and are not older than it
+    try:
+        source_time = os.stat(f"{name}.npy").st_mtime_ns
+        return all(os.stat(file).st_mtime_ns >= source_time for file in files)
+    except OSError:
+        return False
+
+
+def load_quantized(name: str, matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # quantized once and kept next to the matrix, redone when the matrix is newer
+    quantized_file = f"{name}_q8.npy"
+    scales_file = f"{name}_q8_scales.npy"
+    try:
+        if is_fresh(name, quantized_file, scales_file):
+            quantized = np.load(quantized_file, mmap_mode="r")
+            scales = np.load(scales_file)
+            if quantized.shape == matrix.shape and scales.shape == (len(matrix),):
+                return quantized, scales
+    except (OSError, ValueError):
+        pass
+
+    quantized, scales = quantize_rows(matrix)
+    try:
+        np.save(quantized_file, quantized)
+        np.save(scales_file, scales)
+    except OSError:
+        pass  # the cache is optional, the in-memory copy is enough to search
+    return quantized, scales
+
+
+def build_ann_index(matrix: np.ndarray) -> "hnswlib.Index":
+    index = hnswlib.Index(space="cosine", dim=matrix.shape[1])
+    index.init_index(max_elements=len(matrix), ef_construction=200, M=16)
+    index.add_items(matrix, ids=np.arange(len(matrix)))
+    index.set_ef(64)
+    return index
+
+
+def load_ann_index(name: str, matrix: np.ndarray) -> "hnswlib.Index":
+    # built once and saved next to the matrix, rebuilt when the matrix is newer
+    index_file = f"{name}_hnsw.bin"
+    if is_fresh(name, index_file):
+        try:
+            index = hnswlib.Index(space="cosine", dim=matrix.shape[1])
+            index.load_index(index_file, max_elements=len(matrix))
+            if index.get_current_count() == len(matrix):
+                index.set_ef(64)
+                return index
+        except RuntimeError:
+            pass
+
+    index = build_ann_index(matrix)
+    try:
+        index.save_index(index_file)
+    except (OSError, RuntimeError):
+        pass  # the cache is optional, the index built in memory is enough to search
+    return index
+
+
+class EmbedBatcher:
+    """
+    Coalesces concurrent embedding requests: the first queued text opens
+    a short window, everything queued until it closes or the batch is full
+    goes to the server as a single embeddings request.
+    """
+
+    def __init__(self, openai_client: Any, model: str, window: float = EMBED_BATCH_WINDOW, max_batch: int = EMBED_BATCH_SIZE):
+        self.openai_client = openai_client
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue | None = None
+        self.collector: asyncio.Task | None = None
+        self.tasks: set[asyncio.Task] = set()
+
+    async def submit(self, text: str) -> list[float]:
+        # the queue and its collector belong to one event loop, a new loop
+        # (e.g. another asyncio.run) or a finished collector gets new ones
+        loop = asyncio.get_running_loop()
+        if self.collector is None or self.collector.done() or self.collector.get_loop() is not loop:
+            self.queue = asyncio.Queue()
+            self.collector = loop.create_task(self.collect(self.queue))
+
+        future = loop.create_future()
+        self.queue.put_nowait((text, future))
+        return await future
+
+    def spawn(self, coroutine):
+        # the loop keeps only weak references to tasks
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def close(self):
+        for task in [self.collector, *self.tasks]:
+            if task is not None and not task.done():
+                task.cancel()
+
+    async def collect(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            # a full batch goes out without waiting for the rest of the window
+            try:
+                async with asyncio.timeout(self.window):
+                    while len(batch) < self.max_batch:
+                        batch.append(await queue.get())
+            except TimeoutError:
+                pass
+            # sent without waiting, so a slow request doesn't hold back the next window
+            self.spawn(self.send(batch))
+
+    async def send(self, batch: list[tuple[str, asyncio.Future]]):
+        try:
+            response = await self.openai_client.embeddings.create(
+                model=self.model,
+                input=[text for text, _ in batch],
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for data in response.data:
+            if 0 <= data.index < len(batch):
+                future = batch[data.index][1]
+                if not future.done():
+                    future.set_result(data.embedding)
+
+        # rows missing from the response must not leave their callers waiting
+        for text, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError(f"no embedding returned for query '{text}'"))
+
+
+class QueryCache:
+    """
+    LRU of query embeddings, optionally backed by a shelve file
+    so development runs don't pay for the same queries again.
+    """
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, path: str | None = None):
+        self.maxsize = maxsize
+        self.entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.store = shelve.open(path) if path else None
+
+    def get(self, key: str) -> np.ndarray | None:
+        embedding = self.entries.get(key)
+        if embedding is not None:
+            self.entries.move_to_end(key)
+            return embedding
+
+        if self.store is not None:
+            embedding = self.store.get(key)
+            if embedding is not None:
+                embedding = np.asarray(embedding, dtype=np.float32)
+                self.remember(key, embedding)
+        return embedding
+
+    def put(self, key: str, embedding: np.ndarray):
+        self.remember(key, embedding)
+        if self.store is not None:
+            self.store[key] = embedding
+
+    def remember(self, key: str, embedding: np.ndarray):
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        # writes to the store reach the disk here, not on every query
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+def normalize_query(text: str) -> str:
+    # case is meaningful in C++ identifiers, only surrounding whitespace is dropped
+    return text.strip()
 
 
 class SearchService:
     def __init__(self, ctx: CodebaseContext):
         self.ctx = ctx
-
-    async def embed_query(self, text: str) -> list[float]:
-        ctx = self.ctx
-        response = await ctx.openai_client.embeddings.create(
-            model=ctx.embedding_model_name,
-            input=text,
-        )
-        return response.data[0].embedding
+        self.batcher = EmbedBatcher(ctx.openai_client, ctx.embedding_model_name)
+        self.query_cache = QueryCache(path=ctx.query_cache_path)
+        self.scan_pool = None
+        if ctx.emb_quantized is not None and SCAN_THREADS > 1:
+            self.scan_pool = ThreadPoolExecutor(max_workers=SCAN_THREADS)
+        # queries being embedded right now, identical concurrent queries share the request
+        self.pending: dict[str, asyncio.Future] = {}
+
+    def close(self):
+        self.batcher.close()
+        self.query_cache.close()
+        if self.scan_pool is not None:
+            self.scan_pool.shutdown()
+
+    async def embed_query(self, text: str) -> np.ndarray:
+        text = normalize_query(text)
+        key = f"{self.ctx.embedding_model_name}:{text}"
+
+        embedding = self.query_cache.get(key)
+        if embedding is not None:
+            return embedding
+
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self.fetch_query(key, text))
+            self.pending[key] = pending
+            pending.add_done_callback(lambda _: self.pending.pop(key, None))
+        # shielded: a cancelled caller must not cancel the request for the others
+        return await asyncio.shield(pending)
+
+    async def fetch_query(self, key: str, text: str) -> np.ndarray:
+        embedding = np.asarray(await self.batcher.submit(text), dtype=np.float32)
+        self.query_cache.put(key, embedding)
+        return embedding
 
 
     async def raw_semantic_search(
@@ -62,86 +442,122 @@ class SearchService:
         top_k: int = 10,
     ) -> dict[str, float]:
         query_embedding = await self.embed_query(query)
+        norm = np.linalg.norm(query_embedding)
 
-        scored = []
+        # a zero query has no direction, every cosine score would be 0
+        if not self.ctx.embeddings or norm == 0.0:
+            return []
 
-        for item in self.ctx.embeddings:
-            score = cosine_similarity(query_embedding, item["embedding"])
-            scored.append(
-                {
-                    "id": item["id"],
-                    "kind": item["kind"],
-                    "fqn": item["fqn"],
-                    "file": item["file"],
-                    "score": score
-                }
+        # not normalized in place, the embedding is shared with the query cache
+        query_embedding = query_embedding / norm
+
+        if self.ctx.ann_index is not None:
+            return self.ann_search(query_embedding, top_k)
+
+        return self.scan_search(query_embedding, top_k)
+
+
+    def scan_search(self, query: np.ndarray, top_k: int) -> list[dict]:
+        # rows are normalized, so a matrix-vector product gives cosine scores;
+        # the int8 scan moves a quarter of the bytes and picks candidates
+        # which are then rescored with the float32 rows
+        scores = self.quantized_scores(query)
+
+        k = min(top_k, len(scores))
+        if k == 0:
+            return []
+
+        candidates = min(k * RERANK_FACTOR, len(scores))
+        rows = np.sort(np.argpartition(-scores, candidates - 1)[:candidates])
+        scores = np.asarray(self.ctx.emb_matrix[rows], dtype=np.float32) @ query
+
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        return [
+            self.ctx.embedding_hit(rows[i], float(scores[i]))
+            for i in best
+        ]
+
+
+    def quantized_scores(self, query: np.ndarray) -> np.ndarray:
+        quantized = self.ctx.emb_quantized
+        scores = np.empty(len(quantized), dtype=np.float32)
+        step = tile_rows(quantized)
+        tiles = -(-len(quantized) // step)
+
+        if self.scan_pool is None or tiles < 2:
+            self.score_rows(query, scores, 0, len(quantized))
+        else:
+            # each thread takes a contiguous run of whole tiles
+            parts = min(SCAN_THREADS, tiles)
+            bounds = [len(quantized) * i // parts // step * step for i in range(parts)] + [len(quantized)]
+            futures = [
+                self.scan_pool.submit(self.score_rows, query, scores, begin, end)
+                for begin, end in zip(bounds, bounds[1:])
+            ]
+            for future in futures:
+                future.result()
+
+        scores /= self.ctx.emb_scales
+        return scores
+
+
+    def score_rows(self, query: np.ndarray, scores: np.ndarray, begin: int, end: int):
+        quantized = self.ctx.emb_quantized
+        step = tile_rows(quantized)
+        for start in range(begin, end, step):
+            stop = min(start + step, end)
+            np.matmul(
+                quantized[start:stop].astype(np.float32),
+                query,
+                out=scores[start:stop]
             )
 
-        scored.sort(key=lambda x: x["score"], reverse=True)
-        return scored[:top_k]
 
+    def ann_search(self, query_embedding: np.ndarray, top_k: int) -> list[dict]:
+        k = min(top_k, self.ctx.ann_index.get_current_count())
+        if k == 0:
+            return []
 
-    async def search_by_name(self, name: str) -> list[dict[str, str]]:
-        results = dict()
+        labels, distances = self.ctx.ann_index.knn_query(query_embedding, k=k)
 
-        for file in self.ctx.ast_index.values():
-            for cls in file.get("classes", []):
-                if name.lower() in cls["name"].lower():
-                    fqn = cls["fqn"]
-                    if fqn not in results:
-                        results[fqn] = {
-                            "fqn": cls["fqn"],
-                            "kind": cls["kind"]
-                        }
+        return [
+            # hnswlib cosine distance is 1 - cosine similarity
+            self.ctx.embedding_hit(label, 1.0 - float(distance))
+            for label, distance in zip(labels[0], distances[0])
+        ]
 
-                for m in cls.get("methods", []):
-                    if name.lower() in m["name"].lower():
-                        fqn = m["fqn"]
-                        if fqn not in results:
-                            results[fqn] = {
-                                "fqn": m["fqn"],
-                                "kind": m["kind"]
-                            }
 
-            for fn in file.get("functions", []):
-                if name.lower() in fn["name"].lower():
-                    fqn = fn["fqn"]
-                    if fqn not in results:
-                        results[fqn] = {
-                            "fqn": fn["fqn"],
-                            "kind": fn["kind"]
-                        }
+    async def search_by_name(self, name: str) -> list[dict[str, str]]:
+        results = dict()
+        name = name.lower()
+
+        for i in self.ctx.name_candidates(name):
+            if name in self.ctx.names_lower[i]:
+                symbol = self.ctx.symbol_list[i]
+                fqn = symbol["fqn"]
+                if fqn not in results:
+                    results[fqn] = {
+                        "fqn": symbol["fqn"],
+                        "kind": symbol["kind"]
+                    }
 
         return results
 
 
     async def get_symbol(self, fqn: str) -> dict[str, None | str | list[str] | dict[str, None | str | list[str] | dict[str, int] | list[dict[str, str]]]] | None:
-        for file in self.ctx.ast_index.values():
-            for cls in file.get("classes", []):
-                if fqn == cls["fqn"]:
-                    return cls
-
-                for m in cls.get("methods", []):
-                    if fqn == m["fqn"]:
-                        return m
-
-            for fn in file.get("functions", []):
-                if fqn == fn["fqn"]:
-                    return fn
+        return self.ctx.symbol_by_fqn.get(fqn)
 
 
     async def get_class_methods(self, class_fqn: str) -> list[dict[str, str]]:
-        for file in self.ctx.ast_index.values():
-            for cls in file.get("classes", []):
-                if cls["fqn"] == class_fqn:
-                    return [
-                        {
-                            "name": m["name"],
-                            "fqn": m["fqn"]
-                        }
-                        for m in cls.get("methods", [])
-                    ]
-        return []
+        return [
+            {
+                "name": m["name"],
+                "fqn": m["fqn"]
+            }
+            for m in self.ctx.methods_by_class_fqn.get(class_fqn, [])
+        ]
 
 
     def tokenize_query(text: str) -> list[str]:
@@ -151,22 +567,6 @@ class SearchService:
         ]
 
 
-    def name_match_score(symbol: dict, tokens: list[str]) -> float:
-        haystack = " ".join(
-            [
-                symbol.get("name", ""),
-                symbol.get("fqn", "")
-            ]
-        ).lower()
-
-        matches = sum(1 for t in tokens if t in haystack)
-
-        if matches == 0:
-            return 0.0
-
-        return matches / len(tokens)
-
-
     def apply_filters(results: list[dict], flt: dict | None) -> list[dict]:
         if not flt:
             return results
@@ -207,45 +607,13 @@ class SearchService:
         results = {}
 
         # name-based
-        for file in self.ctx.ast_index.values():
-            for cls in file.get("classes", []):
-                score = SearchService.name_match_score(cls, tokens)
-                if score > 0:
-                    results.setdefault(cls["fqn"], {
-                        "fqn": cls["fqn"],
-                        "kind": cls["kind"],
-                        "semantic": 0.0,
-                        "name": 0.0,
-                    })
-                    results[cls["fqn"]]["name"] = max(
-                        results[cls["fqn"]]["name"], score
-                    )
-
-                for m in cls.get("methods", []):
-                    score = SearchService.name_match_score(m, tokens)
-                    if score > 0:
-                        results.setdefault(m["fqn"], {
-                            "fqn": m["fqn"],
-                            "kind": m["kind"],
-                            "semantic": 0.0,
-                            "name": 0.0,
-                        })
-                        results[m["fqn"]]["name"] = max(
-                            results[m["fqn"]]["name"], score
-                        )
-
-            for fn in file.get("functions", []):
-                score = SearchService.name_match_score(fn, tokens)
-                if score > 0:
-                    results.setdefault(fn["fqn"], {
-                        "fqn": fn["fqn"],
-                        "kind": fn["kind"],
-                        "semantic": 0.0,
-                        "name": 0.0,
-                    })
-                    results[fn["fqn"]]["name"] = max(
-                        results[fn["fqn"]]["name"], score
-                    )
+        for fqn, (symbol, score) in self.ctx.name_scores(tokens).items():
+            results[fqn] = {
+                "fqn": fqn,
+                "kind": symbol["kind"],
+                "semantic": 0.0,
+                "name": score,
+            }
 
         # merge semantic
         for fqn, sem_score in semantic_map.items():
@@ -288,5 +656,4 @@ class SearchService:
                 }
             )
 
-        final.sort(key=lambda x: x["score"], reverse=True)
-        return final[:top_k]
+        return heapq.nlargest(top_k, final, key=lambda x: x["score"])
@@ -1,11 +1,11 @@
 from openai import AsyncOpenAI
-from search import SearchService, CodebaseContext
-import asyncio, json, sys
+from search import SearchService, CodebaseContext, load_embeddings
+import asyncio, orjson, sys
 
 
 def load_db(file_name) -> dict:
-    with open(file_name, "r", encoding="utf-8") as file:
-        return json.load(file)
+    with open(file_name, "rb") as file:
+        return orjson.loads(file.read())
 
 async def main():
     client = AsyncOpenAI(
@@ -14,11 +14,17 @@ async def main():
         base_url='http://localhost:8080/v1/'
     )
     
+    ast_index, (embeddings, emb_matrix) = await asyncio.gather(
+        asyncio.to_thread(load_db, "ast.json"),
+        asyncio.to_thread(load_embeddings, "embeddings"),
+    )
     ctx = CodebaseContext(
-        ast_index=load_db("ast.json"),
-        embeddings=load_db("embeddings.json")["embeddings"],
+        ast_index=ast_index,
+        embeddings=embeddings,
+        emb_matrix=emb_matrix,
         embedding_model_name="text-embedding-qwen3-embedding-0.6b",
         openai_client=client,
+        embeddings_name="embeddings",
     )
 
     result = await SearchService(ctx).hybrid_search(